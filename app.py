@@ -1,17 +1,24 @@
 import os
 import io
+import re
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
 import numpy as np
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import plotly.express as px
 import plotly.graph_objects as go
 import pydeck as pdk
-from sklearn.linear_model import LinearRegression
+from sklearn.linear_model import LinearRegression, Ridge
 from sklearn.metrics import r2_score, mean_absolute_percentage_error, mean_squared_error
+# SOC 递推内核与 vpp_core 共用（numba 可选，磁盘缓存需指向可导入模块而非本入口脚本）
+from vpp_core import soc_trajectory
 
 # -----------------------------
 # 配置与主题
@@ -53,20 +60,34 @@ st.markdown("""
 # -----------------------------
 # 工具函数
 # -----------------------------
+@st.cache_resource
+def get_session() -> requests.Session:
+    """共享 HTTP 会话（跨 rerun 复用 TCP/TLS 连接）；仅对建连失败重试，调用方需传 (连接, 读取) 超时以限制重试耗时"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16,
+                          max_retries=Retry(total=3, read=0, backoff_factor=0.3))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+@st.cache_data(ttl=900, show_spinner=False)
+def _get_open_meteo(lat: float, lon: float, tz: str):
+    """Open-Meteo 原始响应（按坐标缓存；请求失败时抛出异常，不进入缓存）"""
+    # Open-Meteo API 支持 forecast，这里调整为获取 forecast 数据
+    url = ("https://api.open-meteo.com/v1/forecast"
+           f"?latitude={lat}&longitude={lon}"
+           "&hourly=shortwave_radiation,temperature_2m"
+           f"&timezone={tz}"
+           "&past_days=2&forecast_days=5") # 明确指定过去和未来天数
+    r = get_session().get(url, timeout=(5, 20))
+    r.raise_for_status()
+    return r.json()
+
 def fetch_open_meteo(lat: float, lon: float, hours: int = 168, tz: str = "Asia/Shanghai"):
     """从 Open-Meteo 获取真实天气/辐照数据（默认获取7天=168小时，覆盖完整的周中/周末周期）"""
     try:
-        end = datetime.utcnow() + timedelta(days=5) # 预测未来5天 + 过去2天
-        start = datetime.utcnow() - timedelta(days=2)
-        # Open-Meteo API 支持 forecast，这里调整为获取 forecast 数据
-        url = ("https://api.open-meteo.com/v1/forecast"
-               f"?latitude={lat}&longitude={lon}"
-               "&hourly=shortwave_radiation,temperature_2m"
-               f"&timezone={tz}"
-               "&past_days=2&forecast_days=5") # 明确指定过去和未来天数
-        r = requests.get(url, timeout=20)
-        r.raise_for_status()
-        data = r.json()
+        # 坐标取3位小数（约100m）作为缓存键，提高命中率
+        data = _get_open_meteo(round(lat, 3), round(lon, 3), tz)
     except Exception as e:
         # 如果API调用失败（如429限流），使用模拟数据兜底
         st.warning(f"天气API繁忙 (Code {getattr(e.response, 'status_code', 'Unknown')})，已自动切换至历史平均气象模拟数据。")
@@ -80,17 +101,13 @@ def fetch_open_meteo(lat: float, lon: float, hours: int = 168, tz: str = "Asia/S
         
         # 模拟辐照：白天有值，正午最大，考虑云遮挡噪声
         # 假设日出6点，日落18点
-        rad_sim = []
-        for h in hours_arr:
-            if 6 <= h <= 18:
-                # 正弦波模拟太阳高度角
-                peak = 800 # W/m2
-                val = peak * np.sin(np.pi * (h - 6) / 12)
-                # 加入云层随机遮挡系数 0.6~1.0
-                val *= np.random.uniform(0.6, 1.0)
-                rad_sim.append(max(0, val))
-            else:
-                rad_sim.append(0.0)
+        hours_np = np.asarray(hours_arr, dtype=np.float64)
+        day_mask = (hours_np >= 6) & (hours_np <= 18)
+        # 正弦波模拟太阳高度角（峰值 800 W/m2）
+        sun = 800.0 * np.sin(np.pi * (hours_np - 6) / 12.0)
+        # 加入云层随机遮挡系数 0.6~1.0
+        cloud = np.random.uniform(0.6, 1.0, size=hours_np.shape)
+        rad_sim = np.where(day_mask, np.maximum(0.0, sun * cloud), 0.0)
                 
         data = {
             "hourly": {
@@ -105,13 +122,15 @@ def fetch_open_meteo(lat: float, lon: float, hours: int = 168, tz: str = "Asia/S
         "radiation": data["hourly"]["shortwave_radiation"],
         "temperature": data["hourly"]["temperature_2m"],
     })
-    return df
+    # 气象量以 float32 存储即可满足精度，减半后续仿真与特征计算的内存流量
+    return df.astype({"radiation": np.float32, "temperature": np.float32})
 
+@st.cache_data(ttl=3600, show_spinner=False)
 def fetch_sz(api_id: str, app_key: str, page: int, rows: int):
     """深圳开放数据平台通用获取函数（通过环境变量配置）"""
     url = f"https://opendata.sz.gov.cn/api/{api_id}/1/service.xhtml"
     params = {"page": int(page), "rows": int(rows), "appKey": app_key}
-    resp = requests.get(url, params=params, timeout=20)
+    resp = get_session().get(url, params=params, timeout=(5, 20))
     resp.raise_for_status()
     try:
         data = resp.json()
@@ -121,7 +140,12 @@ def fetch_sz(api_id: str, app_key: str, page: int, rows: int):
     except Exception:
         return pd.read_csv(io.StringIO(resp.text))
 
-def fetch_overpass_poi(lat: float, lon: float, radius_km: int = 5) -> pd.DataFrame:
+class EmptyPOIResult(Exception):
+    """Overpass 正常返回但没有任何要素（不进入缓存，交给调用方重试）"""
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _get_overpass_poi(lat: float, lon: float, radius_km: int = 5) -> pd.DataFrame:
+    """Overpass POI 查询与解析（按坐标缓存；空结果与请求失败均抛出异常，不进入缓存）"""
     r = radius_km * 1000
     # 增加超时时间到60秒，并请求更多数据类型以增加POI数量
     q = f"""
@@ -137,63 +161,89 @@ def fetch_overpass_poi(lat: float, lon: float, radius_km: int = 5) -> pd.DataFra
     );
     out center;
     """
-    resp = requests.post("https://overpass-api.de/api/interpreter", data=q, timeout=65)
+    resp = get_session().post("https://overpass-api.de/api/interpreter", data=q, timeout=(5, 65))
     resp.raise_for_status()
-    data = resp.json().get("elements", [])
-    rows = []
-    for e in data:
-        tags = e.get("tags", {})
-        lat0 = e.get("lat") or e.get("center", {}).get("lat")
-        lon0 = e.get("lon") or e.get("center", {}).get("lon")
-        cat = "办公服务"
-        
-        # 扩展分类逻辑
-        if "amenity" in tags or "leisure" in tags:
-            cat = "餐饮商超"
-        elif "shop" in tags:
-            cat = "餐饮商超"
-        elif tags.get("landuse") == "industrial" or "craft" in tags:
-            cat = "制造加工"
-        elif tags.get("building") == "warehouse":
-            cat = "仓储物流"
-        elif "office" in tags:
-            cat = "办公服务"
-            
-        rows.append({
-            "工商户名称": tags.get("name", "未知商户"),
-            "所属行业": cat,
-            "经营范围": "城市POI",
-            "注册资本": 100,
-            "经营规模": "M",
-            "lat": lat0,
-            "lon": lon0
-        })
-    return pd.DataFrame(rows)
+    elements = resp.json().get("elements", [])
+    if not elements:
+        raise EmptyPOIResult()
+    df = pd.json_normalize(elements, sep=".")
+    # 缺列占位：标签列用 object，坐标列用 float64（避免 fillna 时的 object 降级告警）
+    missing = pd.Series(np.nan, index=df.index, dtype=object)
+    missing_num = pd.Series(np.nan, index=df.index, dtype=np.float64)
+    
+    def col(c, default=missing):
+        return df[c] if c in df.columns else default
+    
+    def has(k):
+        return col(f"tags.{k}").notna()
+    
+    # 节点自带坐标，way 使用 out center 返回的中心点
+    lat0 = col("lat", missing_num).fillna(col("center.lat", missing_num))
+    lon0 = col("lon", missing_num).fillna(col("center.lon", missing_num))
+    
+    # 扩展分类逻辑（按优先级依次匹配，其余归为办公服务）
+    cat = np.select(
+        [has("amenity") | has("leisure") | has("shop"),
+         (col("tags.landuse") == "industrial") | has("craft"),
+         col("tags.building") == "warehouse"],
+        ["餐饮商超", "制造加工", "仓储物流"],
+        default="办公服务",
+    )
+    
+    return pd.DataFrame({
+        "工商户名称": col("tags.name").fillna("未知商户").to_numpy(),
+        "所属行业": cat.astype(object),
+        "经营范围": "城市POI",
+        "注册资本": 100,
+        "经营规模": "M",
+        "lat": lat0.to_numpy(dtype=np.float64),
+        "lon": lon0.to_numpy(dtype=np.float64)
+    })
+
+def fetch_overpass_poi(lat: float, lon: float, radius_km: int = 5) -> pd.DataFrame:
+    """城市 POI 采集；无结果时返回空表"""
+    try:
+        # 坐标取3位小数（约100m）作为缓存键，与天气接口一致
+        return _get_overpass_poi(round(lat, 3), round(lon, 3), radius_km)
+    except EmptyPOIResult:
+        return pd.DataFrame()
+
+def fetch_poi_with_retry(lat: float, lon: float, radius_km: int = 5, max_retries: int = 3) -> pd.DataFrame:
+    """带重试的 POI 采集：返回空表时短暂等待后重试，全部失败时抛出最后一次异常"""
+    business_df = pd.DataFrame()
+    for i in range(max_retries):
+        try:
+            business_df = fetch_overpass_poi(lat, lon, radius_km=radius_km)
+            if not business_df.empty:
+                break
+            time.sleep(1) # 失败后短暂等待
+        except Exception as e:
+            if i == max_retries - 1: raise e
+            time.sleep(1)
+    return business_df
+
 def generate_synthetic_poi(lat: float, lon: float, n: int = 20) -> pd.DataFrame:
     cats = ["制造加工", "餐饮商超", "仓储物流", "办公服务"]
     prefixes = ["杭州", "浙江", "钱塘", "西湖", "滨江", "之江", "余杭", "萧山"]
     cores = ["科技", "智造", "网络", "实业", "物流", "商贸", "餐饮", "食品", "精密", "创新"]
     suffixes = ["有限公司", "工厂", "中心", "经营部", "责任公司"]
     
-    rows = []
-    for i in range(n):
-        dlat = np.random.uniform(-0.02, 0.02)
-        dlon = np.random.uniform(-0.02, 0.02)
-        cat = np.random.choice(cats)
-        
-        # 生成逼真的随机企业名称
-        name = np.random.choice(prefixes) + np.random.choice(cores) + np.random.choice(suffixes)
-        
-        rows.append({
-            "工商户名称": name,
-            "所属行业": cat,
-            "经营范围": "模拟生成数据",
-            "注册资本": np.random.choice([80, 100, 150, 200, 300, 500, 1000]),
-            "经营规模": np.random.choice(["S","M","L"]),
-            "lat": lat + dlat,
-            "lon": lon + dlon
-        })
-    return pd.DataFrame(rows)
+    # 一次性批量抽样 n 条记录
+    dlat = np.random.uniform(-0.02, 0.02, size=n)
+    dlon = np.random.uniform(-0.02, 0.02, size=n)
+    
+    # 生成逼真的随机企业名称
+    names = np.char.add(np.char.add(np.random.choice(prefixes, n), np.random.choice(cores, n)), np.random.choice(suffixes, n))
+    
+    return pd.DataFrame({
+        "工商户名称": names.astype(object),
+        "所属行业": np.random.choice(cats, n).astype(object),
+        "经营范围": "模拟生成数据",
+        "注册资本": np.random.choice([80, 100, 150, 200, 300, 500, 1000], n),
+        "经营规模": np.random.choice(["S","M","L"], n).astype(object),
+        "lat": lat + dlat,
+        "lon": lon + dlon
+    })
 INDUSTRY_KEYWORDS = {
     "制造加工": ["制造", "加工", "工厂", "食品加工", "机械", "电子", "印刷"],
     "餐饮商超": ["餐饮", "饭店", "超市", "便利店", "零售", "商贸", "食品销售"],
@@ -201,12 +251,32 @@ INDUSTRY_KEYWORDS = {
     "办公服务": ["咨询", "服务", "软件", "设计", "培训", "广告", "会计", "律所", "人力"],
 }
 
+# 每个行业的关键词预编译为一条正则（按 INDUSTRY_KEYWORDS 顺序匹配，先命中者优先）
+INDUSTRY_PATTERNS = {
+    k: re.compile("|".join(re.escape(kw.lower()) for kw in kws))
+    for k, kws in INDUSTRY_KEYWORDS.items()
+}
+
 INDUSTRY_PROFILE = {
     "制造加工": {"base_load": 500, "peak_ratio": 0.6, "profile": "stable_high"},
     "餐饮商超": {"base_load": 150, "peak_ratio": 0.8, "profile": "dual_peak"},
     "仓储物流": {"base_load": 80,  "peak_ratio": 0.3, "profile": "flat"},
     "办公服务": {"base_load": 200, "peak_ratio": 0.7, "profile": "day_high"},
 }
+# 按行业查表用的类型化列（避免转置混合字典得到 object 列）
+BASE_LOAD_BY_INDUSTRY = pd.Series({k: v["base_load"] for k, v in INDUSTRY_PROFILE.items()}, dtype=np.float64)
+PROFILE_BY_INDUSTRY = pd.Series({k: v["profile"] for k, v in INDUSTRY_PROFILE.items()}, dtype=object)
+
+# 经营规模系数
+SCALE_FACTOR = {"S": 0.8, "M": 1.0, "L": 1.2}
+
+# 画像类型中文映射表
+PROFILE_LABELS = {
+    "stable_high": "持续高负荷 (Stable High)",
+    "dual_peak": "双峰型 (Dual Peak)",
+    "flat": "平稳型 (Flat)",
+    "day_high": "日间高峰 (Day High)",
+}
 
 def auto_fetch_businesses(region: str, scenario: str):
     """自动数据源：优先调用开放平台API（通过环境变量），否则使用代理变量生成行业示例数据"""
@@ -223,6 +293,7 @@ def auto_fetch_businesses(region: str, scenario: str):
             pass
     return sample_business_data(scenario=scenario)
 
+@st.cache_data(show_spinner=False)
 def sample_business_data(scenario: str = "制造加工园区"):
     rows = []
     if scenario == "制造加工园区":
@@ -252,6 +323,10 @@ DEFAULT_TOU = {
     "valley": {"hours": [0,1,2,3,4,5,6,23], "price": 0.40},
 }
 
+# 默认峰/谷时段的 24 位掩码：第 h 位为 1 表示该小时属于此时段
+PEAK_MASK = sum(1 << h for h in DEFAULT_TOU["peak"]["hours"])
+VALLEY_MASK = sum(1 << h for h in DEFAULT_TOU["valley"]["hours"])
+
 def classify_industry(row):
     text = f"{row.get('所属行业','')}{row.get('经营范围','')}".lower()
     for k, kws in INDUSTRY_KEYWORDS.items():
@@ -259,6 +334,21 @@ def classify_industry(row):
             return k
     return row.get("所属行业") or "办公服务"
 
+def classify_industries(df: pd.DataFrame) -> pd.Series:
+    """classify_industry 的向量化版本：每个行业对整列做一次正则匹配"""
+    blank = pd.Series("", index=df.index, dtype=object)
+    raw = df["所属行业"].fillna("").astype(str) if "所属行业" in df.columns else blank
+    scope = df["经营范围"].fillna("").astype(str) if "经营范围" in df.columns else blank
+    text = (raw + scope).str.lower()
+    std = raw.where(raw != "", "办公服务").astype(object)
+    assigned = pd.Series(False, index=df.index)
+    for k, pat in INDUSTRY_PATTERNS.items():
+        mask = text.str.contains(pat, regex=True, na=False)
+        std = std.mask(mask & ~assigned, k)
+        assigned |= mask
+    return std
+
+@st.cache_data(show_spinner=False, max_entries=16)
 def ensure_business_df(df: pd.DataFrame) -> pd.DataFrame:
     df = df.copy()
     if "统一社会信用代码" in df.columns:
@@ -272,35 +362,51 @@ def ensure_business_df(df: pd.DataFrame) -> pd.DataFrame:
     df["注册资本"] = pd.to_numeric(df["注册资本"], errors="coerce").fillna(100)
     if "经营规模" not in df.columns:
         df["经营规模"] = "M"
-    df["所属行业标准"] = df.apply(classify_industry, axis=1)
+    df["所属行业标准"] = classify_industries(df)
     return df
 
 def predict_load_for_business(df):
     """基于画像快速预测新增工商户负荷（演示模型）"""
-    preds = []
-    for _, r in df.iterrows():
-        ind = r.get("所属行业标准") or classify_industry(r)
-        profile = INDUSTRY_PROFILE.get(ind, INDUSTRY_PROFILE["办公服务"])
-        cap = pd.to_numeric(r.get("注册资本", 100), errors="coerce")
-        cap = 100 if pd.isna(cap) else float(cap)
-        scale = r.get("经营规模", "M")
-        scale_factor = {"S": 0.8, "M": 1.0, "L": 1.2}.get(scale, 1.0)
-        predicted_peak = profile["base_load"] * (cap / 100) * scale_factor
-        # 中文映射表
-        profile_map = {
-            "stable_high": "持续高负荷 (Stable High)",
-            "dual_peak": "双峰型 (Dual Peak)",
-            "flat": "平稳型 (Flat)",
-            "day_high": "日间高峰 (Day High)"
-        }
-        
-        preds.append({
-            "工商户名称": r.get("工商户名称", r.get("company_name", "未命名")),
-            "所属行业标准": ind,
-            "峰值负荷预测(kW)": round(predicted_peak, 2),
-            "画像类型": profile_map.get(profile["profile"], profile["profile"]),
-        })
-    return pd.DataFrame(preds)
+    n = len(df)
+    if "所属行业标准" in df.columns:
+        ind = df["所属行业标准"]
+        missing = ind.isna() | (ind == "")
+        if missing.any():
+            ind = ind.where(~missing, classify_industries(df[missing]))
+    else:
+        ind = classify_industries(df)
+    # 行业画像查表：未知行业回退到办公服务
+    fallback = INDUSTRY_PROFILE["办公服务"]
+    base_load = ind.map(BASE_LOAD_BY_INDUSTRY).fillna(fallback["base_load"]).to_numpy(dtype=np.float64)
+    profile = ind.map(PROFILE_BY_INDUSTRY).fillna(fallback["profile"])
+    cap = pd.to_numeric(df["注册资本"], errors="coerce").fillna(100.0).to_numpy(dtype=np.float64) if "注册资本" in df.columns else np.full(n, 100.0)
+    sf = df["经营规模"].map(SCALE_FACTOR).fillna(1.0).to_numpy(dtype=np.float64) if "经营规模" in df.columns else np.ones(n)
+    predicted_peak = base_load * (cap / 100) * sf
+    if "工商户名称" in df.columns:
+        names = df["工商户名称"]
+    elif "company_name" in df.columns:
+        names = df["company_name"]
+    else:
+        names = pd.Series("未命名", index=df.index)
+    return pd.DataFrame({
+        "工商户名称": names.to_numpy(),
+        "所属行业标准": ind.to_numpy(),
+        "峰值负荷预测(kW)": np.round(predicted_peak, 2),
+        "画像类型": profile.map(PROFILE_LABELS).fillna(profile).to_numpy(),
+    })
+
+def build_tou_tables(tou: dict):
+    """将分时电价展开为按小时索引的电价表与时段表（时段编码：0=平，1=峰，2=谷）"""
+    price = np.full(24, tou["flat"]["price"], dtype=np.float64)
+    period = np.zeros(24, dtype=np.int8)
+    # 与 price_for_hour 保持一致：峰段优先于谷段
+    price[tou["valley"]["hours"]] = tou["valley"]["price"]
+    period[tou["valley"]["hours"]] = 2
+    price[tou["peak"]["hours"]] = tou["peak"]["price"]
+    period[tou["peak"]["hours"]] = 1
+    return price, period
+
+PERIOD_LABELS = np.array(["平", "峰", "谷"], dtype=object)
 
 def price_for_hour(h: int, tou: dict):
     if h in tou["peak"]["hours"]: return tou["peak"]["price"], "峰"
@@ -318,36 +424,47 @@ def load_simulation(meteo_df, pv_capacity, base_load=12000.0):
     基于天气和时间生成区域负荷曲线
     base_load: 区域基准平均负荷 (kW)，由POI预测汇总得出
     """
-    df = meteo_df.copy()
-    
-    # 模拟光伏出力
-    df["pv_output"] = df["radiation"].apply(lambda x: pv_output_from_radiation(x, pv_capacity))
+    # 先在 NumPy 上算好各列，最后一次性并入，避免复制后逐列插入；仿真序列统一为 float32
+    # 模拟光伏出力（与 pv_output_from_radiation 同一公式，按整列计算）
+    rad = meteo_df["radiation"].to_numpy(dtype=np.float32, copy=False)
+    pv_output = np.clip(rad * (0.2 * pv_capacity / 1000.0), 0.0, pv_capacity)
     
     # 模拟电网负荷：
     # 基准负荷 (动态传入) + 气温影响 + 辐照影响 + 随机波动
     base = base_load
-    noise = np.random.normal(0, base * 0.01, size=len(df)) # 噪声与基准成比例
+    noise = np.random.normal(0, base * 0.01, size=len(meteo_df)).astype(np.float32) # 噪声与基准成比例
     
     # 温度对负荷的影响系数也应与基准成比例（约0.5%每度）
     temp_coef = base * 0.005 
     
-    df["grid_load"] = base + (df["temperature"] - df["temperature"].mean()) * temp_coef + df["radiation"] * 0.8 + noise
+    # 在同一缓冲区上原地累加各项，避免逐项生成中间数组
+    temp = meteo_df["temperature"].to_numpy(dtype=np.float32)
+    gl = temp - temp.mean()
+    gl *= temp_coef
+    gl += base
+    gl += rad * 0.8
+    gl += noise
     
     # 保证负荷非负，且至少有基准的10%（基础负载）
-    df["grid_load"] = df["grid_load"].clip(lower=base * 0.1)
+    np.maximum(gl, base * 0.1, out=gl)
     
-    return df
+    return meteo_df.assign(pv_output=pv_output, grid_load=gl)
 
-def schedule_decision(row, soc: float, tou: dict):
-    """基于峰谷价差的调度策略"""
-    h = pd.to_datetime(row["time"]).hour
+# 优化：提升储能配置以匹配工业园区负荷规模（12MW基准）
+# 假设配置 20% 功率配比，2小时备电：功率 3000kW，容量 15000kWh
+STORAGE_CAPACITY = 15000.0
+STORAGE_MAX_POWER = 3000.0
+SOC_MIN, SOC_MAX = 20.0, 90.0
+
+def schedule_decision(row, soc: float, tou: dict, h: int = None):
+    """基于峰谷价差的调度策略（h 为预先计算的小时，缺省时从 row["time"] 解析）"""
+    if h is None:
+        h = pd.to_datetime(row["time"]).hour
     price, period = price_for_hour(h, tou)
     net_load = row["grid_load"] - row["pv_output"]
-    min_soc, max_soc = 20.0, 90.0
-    # 优化：提升储能配置以匹配工业园区负荷规模（12MW基准）
-    # 假设配置 20% 功率配比，2小时备电：功率 3000kW，容量 15000kWh
-    storage_capacity = 15000.0 
-    max_power = 3000.0
+    min_soc, max_soc = SOC_MIN, SOC_MAX
+    storage_capacity = STORAGE_CAPACITY
+    max_power = STORAGE_MAX_POWER
     storage_power = 0.0
     action = "HOLD"
     reason = "保持基准"
@@ -368,6 +485,46 @@ def schedule_decision(row, soc: float, tou: dict):
     grid_purchase = max(0.0, net_load + storage_power)
     return action, storage_power, grid_purchase, price, period, reason
 
+ACTION_LABELS = np.array(["HOLD", "DISCHARGE", "CHARGE"], dtype=object)
+REASON_LABELS = np.array(["保持基准", "峰段高价，储能放电削峰", "谷段低价，储能充电填谷"], dtype=object)
+# 实时响应等级：负荷波动 <10% / 10~12% / >=12%
+LEVEL_BINS = np.array([10.0, 12.0])
+LEVEL_LABELS = np.array(["轻度", "中度", "重度"], dtype=object)
+
+def simulate_dispatch(df: pd.DataFrame, tou_tables, soc0: float = 60.0, markup: float = 1.10, hours=None) -> pd.DataFrame:
+    """
+    整段时序的调度与经济测算
+    tou_tables: build_tou_tables 生成的 (电价表, 时段表)
+    hours: 预先计算的小时数组，缺省时从 df["time"] 解析
+    只有 SOC 存在时序依赖（soc_trajectory），电价/时段/购电/成本收益均按列计算
+    """
+    if hours is None:
+        hours = pd.to_datetime(df["time"]).dt.hour.to_numpy()
+    price_tab, period_tab = tou_tables
+    price = price_tab[hours]
+    period = period_tab[hours]
+    # 仿真输入可能为 float32；调度与成本核算统一提升到 float64，保证按分汇总的金额不受精度影响
+    grid_load = df["grid_load"].to_numpy(dtype=np.float64)
+    pv_output = df["pv_output"].to_numpy(dtype=np.float64)
+    net_load = grid_load - pv_output
+    # 与 schedule_decision 同一策略：峰段放电、谷段充电、平段保持
+    sp, soc = soc_trajectory(period == 1, period == 2, float(soc0), STORAGE_CAPACITY, SOC_MIN, SOC_MAX, STORAGE_MAX_POWER)
+    gp = np.maximum(0.0, net_load + sp)
+    # 经济测算（与 economic_calc 一致）
+    sales_price = price * markup
+    cost = gp * price
+    revenue = (gp - sp) * sales_price
+    margin = revenue - cost
+    # 放电功率为负、充电为正、保持为零
+    code = np.where(sp < 0, 1, np.where(sp > 0, 2, 0))
+    return pd.DataFrame({
+        "time": df["time"].to_numpy(), "period": PERIOD_LABELS[period], "price": price,
+        "grid_load": np.round(grid_load, 1), "pv_output": np.round(pv_output, 1),
+        "soc": np.round(soc, 1), "action": ACTION_LABELS[code], "storage_power": np.round(sp, 1),
+        "grid_purchase": np.round(gp, 1), "cost": np.round(cost, 2), "revenue": np.round(revenue, 2),
+        "margin": np.round(margin, 2), "reason": REASON_LABELS[code],
+    })
+
 def economic_calc(grid_purchase, storage_power, price):
     sales_price = price * float(st.session_state.get("markup", 1.10))
     cost = grid_purchase * price
@@ -375,19 +532,154 @@ def economic_calc(grid_purchase, storage_power, price):
     margin = revenue - cost
     return round(cost, 2), round(revenue, 2), round(margin, 2)
 
-def build_feature_frame(business_df: pd.DataFrame, meteo_df: pd.DataFrame) -> pd.DataFrame:
+def build_feature_frame(business_df: pd.DataFrame, meteo_df: pd.DataFrame, hours=None) -> pd.DataFrame:
     counts = business_df["所属行业标准"].value_counts()
-    f = meteo_df.copy()
-    f["hour"] = pd.to_datetime(f["time"]).dt.hour
+    n = len(meteo_df)
+    hour = pd.to_datetime(meteo_df["time"]).dt.hour.to_numpy() if hours is None else np.asarray(hours)
     # 时序周期特征
-    f["hour_sin"] = np.sin(2 * np.pi * f["hour"] / 24.0)
-    f["hour_cos"] = np.cos(2 * np.pi * f["hour"] / 24.0)
-    # 峰谷时段哑变量（避免完全共线，使用峰/谷两项）
-    f["is_peak"] = f["hour"].isin(DEFAULT_TOU["peak"]["hours"]).astype(int)
-    f["is_valley"] = f["hour"].isin(DEFAULT_TOU["valley"]["hours"]).astype(int)
-    for k in INDUSTRY_PROFILE.keys():
-        f[f"cnt_{k}"] = int(counts.get(k, 0))
-    return f
+    angle = 2 * np.pi * hour / 24.0
+    extra = {
+        "hour": hour,
+        "hour_sin": np.sin(angle),
+        "hour_cos": np.cos(angle),
+        # 峰谷时段哑变量（避免完全共线，使用峰/谷两项）：移位取位判断所属时段
+        "is_peak": ((PEAK_MASK >> hour) & 1).astype(np.int8),
+        "is_valley": ((VALLEY_MASK >> hour) & 1).astype(np.int8),
+        **{f"cnt_{k}": np.full(n, int(counts.get(k, 0))) for k in INDUSTRY_PROFILE.keys()},
+    }
+    # 新特征先组装成一个 DataFrame 再整体拼接，避免逐列插入造成的碎片化
+    return pd.concat([meteo_df, pd.DataFrame(extra, index=meteo_df.index)], axis=1)
+
+def fit_ridge(X_train: np.ndarray, y_train: np.ndarray):
+    """拟合岭回归模型"""
+    # 使用岭回归提升稳定性
+    model = Ridge(alpha=1.0)
+    model.fit(X_train, y_train)
+    return model
+
+# 特征列 -> 中文展示名 / 公式中的英文变量名
+NAMES_MAP = {
+    "temperature": "温度(temperature)",
+    "radiation": "辐照(radiation)",
+    "hour_sin": "sin(2π·hour/24)",
+    "hour_cos": "cos(2π·hour/24)",
+    "is_peak": "峰段哑变量",
+    "is_valley": "谷段哑变量",
+    "cnt_制造加工": "制造加工计数",
+    "cnt_餐饮商超": "餐饮商超计数",
+    "cnt_仓储物流": "仓储物流计数",
+    "cnt_办公服务": "办公服务计数",
+    "lag1": "负荷滞后项y(t-1)"
+}
+EN_MAP = {
+    "temperature": "temperature",
+    "radiation": "radiation",
+    "hour_sin": "sin(hour)",
+    "hour_cos": "cos(hour)",
+    "is_peak": "is_peak",
+    "is_valley": "is_valley",
+    "cnt_制造加工": "cnt_manufacture",
+    "cnt_餐饮商超": "cnt_retail",
+    "cnt_仓储物流": "cnt_warehouse",
+    "cnt_办公服务": "cnt_office",
+    "lag1": "lag1"
+}
+
+def map_names(feat_cols_t: tuple) -> tuple:
+    """特征列 -> 中文展示名"""
+    return tuple(NAMES_MAP.get(c, c) for c in feat_cols_t)
+
+def map_names_en(feat_cols_t: tuple) -> tuple:
+    """特征列 -> 公式英文变量名"""
+    return tuple(EN_MAP.get(c, c) for c in feat_cols_t)
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def build_coef_figure(names: tuple, coefs: np.ndarray):
+    """模型系数条形图（按特征名与系数缓存）"""
+    coef_df = pd.DataFrame({"特征": list(names), "系数": coefs})
+    fig_coef = px.bar(coef_df, x="特征", y="系数", title="模型系数（线性回归）", color="特征", color_discrete_sequence=["#0ea5e9","#6366f1","#22c55e","#ef4444","#f59e0b","#10b981","#14b8a6"])
+    fig_coef.update_layout(height=300, plot_bgcolor="#fff", paper_bgcolor="#fff", font=dict(color="#111"))
+    return fig_coef
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def build_eval_fig(y_test: np.ndarray, y_pred: np.ndarray):
+    """模型评估曲线：实际 vs 预测（按数组内容缓存）"""
+    # 整理为长表后一次性绘制，避免逐条 add_trace
+    melted = pd.DataFrame({"实际负荷": y_test, "预测负荷": y_pred}).reset_index().melt(id_vars="index", var_name="series", value_name="value")
+    fig_eval = px.line(melted, x="index", y="value", color="series", color_discrete_map={"实际负荷": "#ef4444", "预测负荷": "#22c55e"}, render_mode="webgl")
+    fig_eval.update_layout(height=300, title="模型评估：实际 vs 预测", plot_bgcolor="#fff", paper_bgcolor="#fff", font=dict(color="#111"),
+                           xaxis_title=None, yaxis_title=None, legend_title_text=None)
+    return fig_eval
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def build_cost_fig(val_nodispatch: float, val_dispatch: float, base_line: float):
+    """成本对比柱状图：柱高为实际值减基准线，base 设为基准线"""
+    # 构造用于绘图的数据：减去基准线
+    plot_nodispatch = max(0, val_nodispatch - base_line)
+    plot_dispatch = max(0, val_dispatch - base_line)
+    fig2 = go.Figure()
+    fig2.add_trace(go.Bar(
+        name="无调度 (基准)", 
+        x=["成本"], 
+        y=[plot_nodispatch], 
+        base=base_line,
+        marker_color="#ef4444", 
+        text=[f"{val_nodispatch:.2f}"], 
+        textposition='auto',
+        hovertemplate="无调度成本: %{text}<extra></extra>"
+    ))
+    fig2.add_trace(go.Bar(
+        name="有调度 (优化)", 
+        x=["成本"], 
+        y=[plot_dispatch], 
+        base=base_line,
+        marker_color="#22c55e", 
+        text=[f"{val_dispatch:.2f}"], 
+        textposition='auto',
+        hovertemplate="有调度成本: %{text}<extra></extra>"
+    ))
+    # 更新Y轴范围，使其从基准线附近开始显示，增强差异感
+    fig2.update_layout(
+        barmode='group', 
+        height=300, 
+        title="成本对比", 
+        plot_bgcolor="#fff", 
+        paper_bgcolor="#fff", 
+        font=dict(color="#111"),
+        yaxis=dict(range=[base_line, None]) # 强制Y轴从基准线开始显示
+    )
+    return fig2
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def build_purchase_fig(base_t: np.ndarray, base_gp: np.ndarray, act_t: np.ndarray, act_gp: np.ndarray):
+    """购电量时间序列对比：无调度 vs 有调度"""
+    long_df = pd.concat([
+        pd.DataFrame({"time": base_t, "series": "无调度购电", "value": base_gp}),
+        pd.DataFrame({"time": act_t, "series": "有调度购电", "value": act_gp}),
+    ], ignore_index=True)
+    fig3 = px.line(long_df, x="time", y="value", color="series", color_discrete_map={"无调度购电": "#ef4444", "有调度购电": "#22c55e"}, render_mode="webgl")
+    fig3.update_layout(height=300, title="购电量时间序列对比", plot_bgcolor="#fff", paper_bgcolor="#fff", font=dict(color="#111"),
+                       xaxis_title=None, yaxis_title=None, legend_title_text=None)
+    return fig3
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def build_latex(feat_cols_t: tuple, coefs_t: np.ndarray, intercept: float):
+    """模型公式 LaTeX（英文变量名，三行）"""
+    beta0 = f"{intercept:.3f}"
+    # 各项只格式化一次，再切成三段
+    parts = [f"{coef:.3f}\\,{name}" for name, coef in zip(map_names_en(feat_cols_t), coefs_t)]
+    g1, g2, g3 = parts[:4], parts[4:8], parts[8:]
+    line1 = " + ".join(g1) if g1 else "0"
+    line2 = " + ".join(g2) if g2 else "0"
+    line3 = " + ".join(g3) if g3 else "0"
+    latex_tpl = r"""
+        \begin{{aligned}}
+        y(t) &= {beta0} + {line1} \\
+             &\quad + {line2} \\
+             &\quad + {line3} + \epsilon
+        \end{{aligned}}
+        """
+    return latex_tpl.format(beta0=beta0, line1=line1, line2=line2, line3=line3)
 
 def train_eval_model(f: pd.DataFrame):
     # 引入负荷滞后项
@@ -401,10 +693,7 @@ def train_eval_model(f: pd.DataFrame):
     split = max(1, int(n * 0.75))
     X_train, y_train = X[:split], y[:split]
     X_test, y_test = X[split:], y[split:]
-    # 使用岭回归提升稳定性
-    from sklearn.linear_model import Ridge
-    model = Ridge(alpha=1.0)
-    model.fit(X_train, y_train)
+    model = fit_ridge(X_train, y_train)
     y_pred = model.predict(X_test)
     r2 = r2_score(y_test, y_pred)
     mape = mean_absolute_percentage_error(y_test, y_pred)
@@ -507,41 +796,42 @@ tou = {
 st.markdown("---")
 start_clicked = st.button("开始分析")
 
+# session_state 缺省值共用同一个空表（只读，不要原地修改）
+EMPTY_DF = pd.DataFrame()
+
 
 def run_pipeline(lat, lon, pv_capacity, tou):
+    tou_tables = build_tou_tables(tou)
     progress = st.progress(0)
     status = st.empty()
-    business_df = st.session_state.get("business_df", pd.DataFrame())
-    if business_df.empty:
-        try:
+    business_df = st.session_state.get("business_df", EMPTY_DF)
+    # POI 与天气两路请求互不依赖：POI（含重试）放到后台线程，与天气请求并行
+    with ThreadPoolExecutor(max_workers=1, initializer=add_script_run_ctx,
+                            initargs=(None, get_script_run_ctx())) as pool:
+        poi_future = None
+        if business_df.empty:
             # 增加重试机制和更宽松的超时设置
-            max_retries = 3
-            for i in range(max_retries):
-                try:
-                    business_df = fetch_overpass_poi(lat, lon, radius_km=st.session_state.get("poi_radius", 5))
-                    if not business_df.empty:
-                        break
-                    time.sleep(1) # 失败后短暂等待
-                except Exception as e:
-                    if i == max_retries - 1: raise e
-                    time.sleep(1)
-        except Exception:
-            # 仅在所有重试都失败后，才回退到合成数据
-            business_df = generate_synthetic_poi(lat, lon, n=24) # 统一使用更逼真的合成数据生成函数
-            st.warning("⚠️ 实时POI数据服务繁忙，已切换至高性能仿真数据源。")
-        
-        if business_df.empty or ("lat" not in business_df.columns):
-            business_df = generate_synthetic_poi(lat, lon, n=24)
-        
-        st.session_state["business_df"] = business_df
-        # st.info("已自动获取业务数据来源，可在“数据采集”模块查看与替换") # 减少非必要打扰
-    progress.progress(10); status.write("正在获取天气/辐照数据")
-    try:
-        # 获取更长周期的数据（7天），以展示完整的周调度效果
-        meteo_df = fetch_open_meteo(lat, lon, hours=168)
-    except Exception as e:
-        st.error(f"天气数据获取失败：{e}")
-        return
+            poi_future = pool.submit(fetch_poi_with_retry, lat, lon, st.session_state.get("poi_radius", 5))
+        progress.progress(10); status.write("正在获取天气/辐照数据")
+        try:
+            # 获取更长周期的数据（7天），以展示完整的周调度效果
+            meteo_df = fetch_open_meteo(lat, lon, hours=168)
+        except Exception as e:
+            st.error(f"天气数据获取失败：{e}")
+            return
+        if poi_future is not None:
+            try:
+                business_df = poi_future.result()
+            except Exception:
+                # 仅在所有重试都失败后，才回退到合成数据
+                business_df = generate_synthetic_poi(lat, lon, n=24) # 统一使用更逼真的合成数据生成函数
+                st.warning("⚠️ 实时POI数据服务繁忙，已切换至高性能仿真数据源。")
+            
+            if business_df.empty or ("lat" not in business_df.columns):
+                business_df = generate_synthetic_poi(lat, lon, n=24)
+            
+            st.session_state["business_df"] = business_df
+            # st.info("已自动获取业务数据来源，可在“数据采集”模块查看与替换") # 减少非必要打扰
     progress.progress(35); status.write("正在进行画像匹配与负荷预测")
     business_df = ensure_business_df(business_df)
     preds_df = predict_load_for_business(business_df)
@@ -562,20 +852,11 @@ def run_pipeline(lat, lon, pv_capacity, tou):
         
     # 调用更新后的仿真函数，传入动态计算的基准负荷
     df = load_simulation(meteo_df, pv_capacity, base_load=base_load_sim)
+    # 小时序列只解析一次，供调度、峰段统计与特征构造复用
+    hours = pd.to_datetime(df["time"]).dt.hour.to_numpy()
     
-    soc = 60.0
-    actions = []
-    for _, r in df.iterrows():
-        action, sp, gp, price, period, reason = schedule_decision(r, soc, tou)
-        # SOC 更新（简化）
-        soc = np.clip(soc + (sp / 15000.0) * 100, 0, 100)
-        cost, revenue, margin = economic_calc(gp, sp, price)
-        actions.append({"time": r["time"], "period": period, "price": price,
-                        "grid_load": round(r["grid_load"],1), "pv_output": round(r["pv_output"],1),
-                        "soc": round(soc,1), "action": action, "storage_power": round(sp,1),
-                        "grid_purchase": round(gp,1), "cost": cost, "revenue": revenue, "margin": margin,
-                        "reason": reason})
-    act_df = pd.DataFrame(actions)
+    markup = float(st.session_state.get("markup", 1.10))
+    act_df = simulate_dispatch(df, tou_tables, soc0=60.0, markup=markup, hours=hours)
     progress.progress(80); status.write("正在进行成本核算与效果汇总")
     
     # 汇总并保留2位小数，避免浮点数累积误差导致显示不一致
@@ -584,17 +865,19 @@ def run_pipeline(lat, lon, pv_capacity, tou):
     # 强制毛利 = 营收 - 成本，确保KPI面板数字逻辑闭环
     total_margin = round(total_rev - total_cost, 2)
     
-    peak_hours = tou["peak"]["hours"]
-    act_df["hour"] = pd.to_datetime(act_df["time"]).dt.hour
-    peak_df = act_df[act_df["hour"].isin(peak_hours)]
+    act_df["hour"] = hours
+    peak_df = act_df[tou_tables[1][hours] == 1]
     baseline_purchase = np.maximum(0.0, peak_df["grid_load"] - peak_df["pv_output"])
     reduction = (baseline_purchase - peak_df["grid_purchase"]).clip(lower=0).sum()
     base_df = act_df.copy()
     base_df["storage_power"] = 0.0
     base_df["grid_purchase"] = np.maximum(0.0, base_df["grid_load"] - base_df["pv_output"])
-    base_df["cost"], base_df["revenue"], base_df["margin"] = zip(*[
-        economic_calc(gp, 0.0, p) for gp, p in zip(base_df["grid_purchase"], base_df["price"])
-    ])
+    # 无调度场景的经济测算（储能功率为0，与 economic_calc 一致）
+    base_gp = base_df["grid_purchase"].to_numpy(dtype=np.float64)
+    base_price = base_df["price"].to_numpy(dtype=np.float64)
+    base_cost = base_gp * base_price
+    base_rev = base_gp * (base_price * markup)
+    base_df[["cost", "revenue", "margin"]] = np.round(np.column_stack([base_cost, base_rev, base_rev - base_cost]), 2)
     
     # 无调度场景的聚合计算
     nodispatch_cost = round(base_df["cost"].sum(), 2)
@@ -610,7 +893,8 @@ def run_pipeline(lat, lon, pv_capacity, tou):
     comp["cost_saving"] = round(comp["cost_nodispatch"] - comp["cost_dispatch"], 2)
     comp["margin_gain"] = round(comp["margin_dispatch"] - comp["margin_nodispatch"], 2)
     
-    f_feat = build_feature_frame(ensure_business_df(business_df), df)
+    # business_df 已在画像匹配阶段标准化，直接复用
+    f_feat = build_feature_frame(business_df, df, hours)
     model_res = train_eval_model(f_feat.assign(grid_load=df["grid_load"]))
     st.session_state["preds_df"] = preds_df
     st.session_state["act_df"] = act_df
@@ -663,7 +947,7 @@ else:
     3. <b>毛利</b> = 预计营收 - 综合成本（反映运营盈利能力）
     """, unsafe_allow_html=True)
 
-    business_df = st.session_state.get("business_df", pd.DataFrame())
+    business_df = st.session_state.get("business_df", EMPTY_DF)
     if not business_df.empty and "lat" in business_df.columns:
         st.subheader("城市画像地图")
         
@@ -699,103 +983,53 @@ else:
         <span style='color:#a855f7'>● 紫色：仓储物流（平稳低耗，24h运行）</span> &nbsp;&nbsp;
         <span style='color:#0ea5e9'>● 蓝色：办公服务（日间高峰，朝九晚五）</span>
         """, unsafe_allow_html=True)
-    meteo_df = st.session_state.get("meteo_df", pd.DataFrame())
+    meteo_df = st.session_state.get("meteo_df", EMPTY_DF)
     if not meteo_df.empty:
         figm = go.Figure()
-        figm.add_trace(go.Scatter(x=meteo_df["time"], y=meteo_df["radiation"], name="辐照", line=dict(color="#6366f1")))
-        figm.add_trace(go.Scatter(x=meteo_df["time"], y=meteo_df["temperature"], name="温度", line=dict(color="#0ea5e9")))
+        figm.add_trace(go.Scattergl(x=meteo_df["time"], y=meteo_df["radiation"], name="辐照", line=dict(color="#6366f1")))
+        figm.add_trace(go.Scattergl(x=meteo_df["time"], y=meteo_df["temperature"], name="温度", line=dict(color="#0ea5e9")))
         figm.update_layout(height=300, title="天气/辐照", plot_bgcolor="#fff", paper_bgcolor="#fff", font=dict(color="#111"))
         st.plotly_chart(figm, use_container_width=True)
         t0 = pd.to_datetime(meteo_df["time"]).min()
         t1 = pd.to_datetime(meteo_df["time"]).max()
         st.caption(f"数据来源：Open-Meteo API；时区：Asia/Shanghai；时间范围：{t0:%Y-%m-%d %H:%M} 至 {t1:%Y-%m-%d %H:%M}。紫色：短波辐照；蓝色：气温。两者共同影响区域负荷与光伏出力。")
-    preds_df = st.session_state.get("preds_df", pd.DataFrame())
+    preds_df = st.session_state.get("preds_df", EMPTY_DF)
     if not preds_df.empty:
         st.subheader("新增工商负荷预测")
         st.dataframe(preds_df, use_container_width=True, height=300)
         st.caption("数据来源：工商画像（注册资本/行业特征）× 行业用电基准；预测方法：基于OpenStreetMap获取的POI点位，结合不同行业的典型日负荷曲线（制造/商超/物流/办公）与规模系数，预测未来接入的潜在新增负荷峰值。")
-    act_df = st.session_state.get("act_df", pd.DataFrame())
+    # 本区块用到的结果只从 session_state 读取一次
+    act_df = st.session_state.get("act_df", EMPTY_DF)
+    base_df = st.session_state.get("base_df", EMPTY_DF)
+    comp = st.session_state.get("compare", None)
+    model_res = st.session_state.get("model_res", None)
     if not act_df.empty:
         fig1 = go.Figure()
-        fig1.add_trace(go.Scatter(x=act_df["time"], y=act_df["grid_load"], name="区域总负荷", line=dict(color="#0f766e")))
-        fig1.add_trace(go.Scatter(x=act_df["time"], y=act_df["pv_output"], name="光伏出力", line=dict(color="#22c55e")))
-        fig1.add_trace(go.Scatter(x=act_df["time"], y=act_df["grid_purchase"], name="电网购电", line=dict(color="#ef4444")))
+        fig1.add_trace(go.Scattergl(x=act_df["time"], y=act_df["grid_load"], name="区域总负荷", line=dict(color="#0f766e")))
+        fig1.add_trace(go.Scattergl(x=act_df["time"], y=act_df["pv_output"], name="光伏出力", line=dict(color="#22c55e")))
+        fig1.add_trace(go.Scattergl(x=act_df["time"], y=act_df["grid_purchase"], name="电网购电", line=dict(color="#ef4444")))
         fig1.update_layout(height=300, title="负荷/出力/购电趋势", plot_bgcolor="#fff", paper_bgcolor="#fff", font=dict(color="#111"))
         st.plotly_chart(fig1, use_container_width=True)
         st.caption("数据来源：预测负荷与天气驱动的出力计算；绿线=光伏出力，红线=电网购电，墨绿线=区域总负荷。核心逻辑：峰段减购电、谷段合理充电。")
-        base_df = st.session_state.get("base_df", pd.DataFrame())
-        model_res = st.session_state.get("model_res", None)
     if model_res:
         m = model_res
         st.subheader("模型拟合与指标")
         st.markdown(f"<div class='metric-card'>R²：<b class='green'>{m['r2']:.3f}</b> · MAPE：<b class='yellow'>{m['mape']*100:.2f}%</b> · RMSE：<b class='yellow'>{m['rmse']:.2f}</b></div>", unsafe_allow_html=True)
-        df_eval = pd.DataFrame({"实际负荷": m["y_test"], "预测负荷": m["y_pred"]})
-        fig_eval = go.Figure()
-        fig_eval.add_trace(go.Scatter(y=df_eval["实际负荷"], name="实际负荷", line=dict(color="#ef4444")))
-        fig_eval.add_trace(go.Scatter(y=df_eval["预测负荷"], name="预测负荷", line=dict(color="#22c55e")))
-        fig_eval.update_layout(height=300, title="模型评估：实际 vs 预测", plot_bgcolor="#fff", paper_bgcolor="#fff", font=dict(color="#111"))
+        fig_eval = build_eval_fig(m["y_test"], m["y_pred"])
         st.plotly_chart(fig_eval, use_container_width=True)
         st.caption("数据来源：特征框架（温度/辐照/小时周期/峰谷/行业计数/滞后）；方法：Ridge回归；红线=实际负荷，绿线=预测负荷；R²/MAPE/RMSE衡量拟合优度与误差水平。")
         # 系数条形图（与特征列对应）
-        names_map = {
-            "temperature": "温度(temperature)",
-            "radiation": "辐照(radiation)",
-            "hour_sin": "sin(2π·hour/24)",
-            "hour_cos": "cos(2π·hour/24)",
-            "is_peak": "峰段哑变量",
-            "is_valley": "谷段哑变量",
-            "cnt_制造加工": "制造加工计数",
-            "cnt_餐饮商超": "餐饮商超计数",
-            "cnt_仓储物流": "仓储物流计数",
-            "cnt_办公服务": "办公服务计数",
-            "lag1": "负荷滞后项y(t-1)"
-        }
         feat_cols = m["feat_cols"]
-        coefs = list(m["model"].coef_)
-        names = [names_map.get(c, c) for c in feat_cols]
-        coef_df = pd.DataFrame({"特征": names, "系数": coefs})
-        fig_coef = px.bar(coef_df, x="特征", y="系数", title="模型系数（线性回归）", color="特征", color_discrete_sequence=["#0ea5e9","#6366f1","#22c55e","#ef4444","#f59e0b","#10b981","#14b8a6"])
-        fig_coef.update_layout(height=300, plot_bgcolor="#fff", paper_bgcolor="#fff", font=dict(color="#111"))
+        # 系数保持 ndarray 直接传入（st.cache_data 按内容哈希数组）
+        coefs = m["model"].coef_
+        fig_coef = build_coef_figure(map_names(tuple(feat_cols)), coefs)
         st.caption("系数越大，特征对负荷的影响越强；正系数表示正相关，负系数表示负相关。")
         st.plotly_chart(fig_coef, use_container_width=True)
-        # 分行显示公式（英文变量名，三行）
-        beta0 = f"{m['model'].intercept_:.3f}"
-        # 英文名映射
-        en_map = {
-            "temperature": "temperature",
-            "radiation": "radiation",
-            "hour_sin": "sin(hour)",
-            "hour_cos": "cos(hour)",
-            "is_peak": "is_peak",
-            "is_valley": "is_valley",
-            "cnt_制造加工": "cnt_manufacture",
-            "cnt_餐饮商超": "cnt_retail",
-            "cnt_仓储物流": "cnt_warehouse",
-            "cnt_办公服务": "cnt_office",
-            "lag1": "lag1"
-        }
-        feat_cols = m["feat_cols"]
-        names_en = [en_map.get(c, c) for c in feat_cols]
-        # 三段
-        g1 = list(zip(names_en[:4], coefs[:4]))
-        g2 = list(zip(names_en[4:8], coefs[4:8]))
-        g3 = list(zip(names_en[8:], coefs[8:]))
-        line1 = " + ".join([f"{coef:.3f}\\,{name}" for name, coef in g1]) if g1 else "0"
-        line2 = " + ".join([f"{coef:.3f}\\,{name}" for name, coef in g2]) if g2 else "0"
-        line3 = " + ".join([f"{coef:.3f}\\,{name}" for name, coef in g3]) if g3 else "0"
-        latex_tpl = r"""
-        \begin{{aligned}}
-        y(t) &= {beta0} + {line1} \\
-             &\quad + {line2} \\
-             &\quad + {line3} + \epsilon
-        \end{{aligned}}
-        """
-        latex_str = latex_tpl.format(beta0=beta0, line1=line1, line2=line2, line3=line3)
+        # 分行显示公式（英文变量名，三行）；系数按显示精度取整后作为缓存键
+        latex_str = build_latex(tuple(feat_cols), np.round(coefs, 3), round(float(m['model'].intercept_), 3))
         st.latex(latex_str)
         st.caption("变量说明：temperature=温度，radiation=辐照，sin(hour)/cos(hour)=小时周期项，is_peak/is_valley=峰/谷哑变量，cnt_*=行业计数，lag1=负荷滞后项y(t-1)。")
 
-    comp = st.session_state.get("compare", None)
-    base_df = st.session_state.get("base_df", pd.DataFrame())
     if comp and not base_df.empty:
         st.markdown("---")
         st.subheader("调度效益对比分析")
@@ -812,55 +1046,14 @@ else:
                 base_line = 0
             
             # 显示的柱子高度 = 实际值 - 基准线
-            val_nodispatch = comp["cost_nodispatch"]
-            val_dispatch = comp["cost_dispatch"]
-            
-            # 构造用于绘图的数据：减去基准线
-            plot_nodispatch = max(0, val_nodispatch - base_line)
-            plot_dispatch = max(0, val_dispatch - base_line)
-            
-            fig2 = go.Figure()
-            # 绘制柱状图，注意y轴是减去基准线后的值，但base参数设置为基准线
-            
-            fig2.add_trace(go.Bar(
-                name="无调度 (基准)", 
-                x=["成本"], 
-                y=[plot_nodispatch], 
-                base=base_line,
-                marker_color="#ef4444", 
-                text=[f"{val_nodispatch:.2f}"], 
-                textposition='auto',
-                hovertemplate="无调度成本: %{text}<extra></extra>"
-            ))
-            fig2.add_trace(go.Bar(
-                name="有调度 (优化)", 
-                x=["成本"], 
-                y=[plot_dispatch], 
-                base=base_line,
-                marker_color="#22c55e", 
-                text=[f"{val_dispatch:.2f}"], 
-                textposition='auto',
-                hovertemplate="有调度成本: %{text}<extra></extra>"
-            ))
-            
-            # 更新Y轴范围，使其从基准线附近开始显示，增强差异感
-            fig2.update_layout(
-                barmode='group', 
-                height=300, 
-                title="成本对比", 
-                plot_bgcolor="#fff", 
-                paper_bgcolor="#fff", 
-                font=dict(color="#111"),
-                yaxis=dict(range=[base_line, None]) # 强制Y轴从基准线开始显示
-            )
-            st.plotly_chart(fig2, use_container_width=True)
+            fig2 = build_cost_fig(float(comp["cost_nodispatch"]), float(comp["cost_dispatch"]), base_line)
+            # 仅两根柱子且数值已标注在柱上，按静态图渲染，省去交互层开销
+            st.plotly_chart(fig2, use_container_width=True, config={"staticPlot": True, "displayModeBar": False})
             
             # 移除原来的局部解读，统一放到下方
         with col_c2:
-            fig3 = go.Figure()
-            fig3.add_trace(go.Scatter(x=base_df["time"], y=base_df["grid_purchase"], name="无调度购电", line=dict(color="#ef4444")))
-            fig3.add_trace(go.Scatter(x=act_df["time"], y=act_df["grid_purchase"], name="有调度购电", line=dict(color="#22c55e")))
-            fig3.update_layout(height=300, title="购电量时间序列对比", plot_bgcolor="#fff", paper_bgcolor="#fff", font=dict(color="#111"))
+            fig3 = build_purchase_fig(base_df["time"].to_numpy(), base_df["grid_purchase"].to_numpy(),
+                                      act_df["time"].to_numpy(), act_df["grid_purchase"].to_numpy())
             st.plotly_chart(fig3, use_container_width=True)
         
         # 统一的数据来源与图例说明（全宽），解决左侧空白不对齐问题
@@ -900,7 +1093,7 @@ if False:
         try:
             meteo_df = fetch_open_meteo(lat, lon, hours=48)
             st.success(f"已获取 {len(meteo_df)} 条 {region} 近48小时数据")
-            fig = px.line(meteo_df, x="time", y=["radiation", "temperature"], labels={"value": "数值", "variable": "指标"})
+            fig = px.line(meteo_df, x="time", y=["radiation", "temperature"], labels={"value": "数值", "variable": "指标"}, render_mode="webgl")
             st.plotly_chart(fig, use_container_width=True)
         except Exception as e:
             st.error(f"天气数据获取失败：{e}")
@@ -953,7 +1146,7 @@ if False:
                 st.error(f"读取失败：{e}")
         elif url_text:
             try:
-                resp = requests.get(url_text, timeout=20)
+                resp = get_session().get(url_text, timeout=(5, 20))
                 ct = resp.headers.get("Content-Type","")
                 if "application/json" in ct or url_text.lower().endswith(".json"):
                     arr = resp.json()
@@ -975,7 +1168,7 @@ if False:
 # -----------------------------
 if False:
     st.markdown("<div class='section-title'>2. 负荷预测（短期/中长期）</div>", unsafe_allow_html=True)
-    business_df = st.session_state.get("business_df", pd.DataFrame())
+    business_df = st.session_state.get("business_df", EMPTY_DF)
     if business_df.empty:
         st.warning("请先在“数据采集”页提供工商户数据")
     else:
@@ -988,7 +1181,7 @@ if False:
 
 if False:
     st.markdown("<div class='section-title'>城市画像（POI分布与行业负荷）</div>", unsafe_allow_html=True)
-    business_df = st.session_state.get("business_df", pd.DataFrame())
+    business_df = st.session_state.get("business_df", EMPTY_DF)
     if business_df.empty or "lat" not in business_df.columns:
         st.info("选择“数据来源=城市POI画像”并点击“开始分析”以生成地图")
     else:
@@ -1007,8 +1200,8 @@ if False:
 
 if False:
     st.markdown("<div class='section-title'>无调度 vs 有调度 对比</div>", unsafe_allow_html=True)
-    act_df = st.session_state.get("act_df", pd.DataFrame())
-    base_df = st.session_state.get("base_df", pd.DataFrame())
+    act_df = st.session_state.get("act_df", EMPTY_DF)
+    base_df = st.session_state.get("base_df", EMPTY_DF)
     comp = st.session_state.get("compare", None)
     if act_df.empty or base_df.empty or not comp:
         st.info("点击“开始分析”以生成对比结果")
@@ -1025,8 +1218,8 @@ if False:
             st.plotly_chart(fig, use_container_width=True)
         st.subheader("购电量时间序列对比")
         fig3 = go.Figure()
-        fig3.add_trace(go.Scatter(x=base_df["time"], y=base_df["grid_purchase"], name="无调度购电"))
-        fig3.add_trace(go.Scatter(x=act_df["time"], y=act_df["grid_purchase"], name="有调度购电"))
+        fig3.add_trace(go.Scattergl(x=base_df["time"], y=base_df["grid_purchase"], name="无调度购电"))
+        fig3.add_trace(go.Scattergl(x=act_df["time"], y=act_df["grid_purchase"], name="有调度购电"))
         st.plotly_chart(fig3, use_container_width=True)
 
 # -----------------------------
@@ -1039,47 +1232,68 @@ if False:
     else:
         # 构造电网负荷 & PV 出力
         df = meteo_df.copy()
-        df["pv_output"] = df["radiation"].apply(lambda x: pv_output_from_radiation(x, pv_capacity))
+        # 与 pv_output_from_radiation 同一公式，按整列计算
+        df["pv_output"] = np.clip(df["radiation"].to_numpy(dtype=np.float64) * (0.2 * pv_capacity / 1000.0), 0.0, pv_capacity)
         # 简易区域总负荷：基础 + 温度/辐照驱动（演示）
         base = 3000
         df["grid_load"] = base + (df["temperature"] - df["temperature"].mean()) * 50 + df["radiation"] * 0.8
         # 初始SOC
         soc = 60.0
-        actions = []
-        for _, r in df.iterrows():
-            action, sp, gp, price, period, reason = schedule_decision(r, soc, tou)
+        hours = pd.to_datetime(df["time"]).dt.hour.to_numpy()
+        # 按列预分配结果数组，循环内只做标量写入，最后一次性构造 DataFrame
+        N = len(df)
+        out = {
+            "time": df["time"].to_numpy(), "period": np.empty(N, dtype=object), "price": np.empty(N),
+            "grid_load": np.round(df["grid_load"].to_numpy(dtype=np.float64), 1),
+            "pv_output": np.round(df["pv_output"].to_numpy(dtype=np.float64), 1),
+            "soc": np.empty(N), "action": np.empty(N, dtype=object), "storage_power": np.empty(N),
+            "grid_purchase": np.empty(N), "cost": np.empty(N), "revenue": np.empty(N), "margin": np.empty(N),
+            "reason": np.empty(N, dtype=object),
+        }
+        rows = df[["grid_load", "pv_output"]].itertuples(index=False, name=None)
+        for i, (h, (gl, pv)) in enumerate(zip(hours, rows)):
+            action, sp, gp, price, period, reason = schedule_decision({"grid_load": gl, "pv_output": pv}, soc, tou, h)
             # SOC 更新（简化）
             soc = np.clip(soc + (sp / 2000.0) * 100, 0, 100)
             cost, revenue, margin = economic_calc(gp, sp, price)
-            actions.append({
-                "time": r["time"], "period": period, "price": price,
-                "grid_load": round(r["grid_load"],1), "pv_output": round(r["pv_output"],1),
-                "soc": round(soc,1), "action": action, "storage_power": round(sp,1),
-                "grid_purchase": round(gp,1), "cost": cost, "revenue": revenue, "margin": margin,
-                "reason": reason
-            })
-        act_df = pd.DataFrame(actions)
+            out["period"][i] = period
+            out["price"][i] = price
+            out["soc"][i] = round(soc, 1)
+            out["action"][i] = action
+            out["storage_power"][i] = round(sp, 1)
+            out["grid_purchase"][i] = round(gp, 1)
+            out["cost"][i], out["revenue"][i], out["margin"][i] = cost, revenue, margin
+            out["reason"][i] = reason
+        act_df = pd.DataFrame(out)
         st.session_state["act_df"] = act_df
         # 可视化
         fig1 = go.Figure()
-        fig1.add_trace(go.Scatter(x=act_df["time"], y=act_df["grid_load"], name="区域总负荷"))
-        fig1.add_trace(go.Scatter(x=act_df["time"], y=act_df["pv_output"], name="光伏出力"))
-        fig1.add_trace(go.Scatter(x=act_df["time"], y=act_df["grid_purchase"], name="电网购电"))
+        fig1.add_trace(go.Scattergl(x=act_df["time"], y=act_df["grid_load"], name="区域总负荷"))
+        fig1.add_trace(go.Scattergl(x=act_df["time"], y=act_df["pv_output"], name="光伏出力"))
+        fig1.add_trace(go.Scattergl(x=act_df["time"], y=act_df["grid_purchase"], name="电网购电"))
         fig1.update_layout(height=380, title="负荷/出力/购电趋势")
         st.plotly_chart(fig1, use_container_width=True)
         st.dataframe(act_df.tail(24))
         # 实时响应统计
         st.markdown("<div class='section-title'>实时响应统计</div>", unsafe_allow_html=True)
-        fluct = (act_df["grid_load"].pct_change().abs() * 100).fillna(0)
-        level = np.where(fluct >= 12, "重度", np.where(fluct >= 10, "中度", "轻度"))
-        st.write(pd.DataFrame({"time": act_df["time"], "波动%": fluct.round(1), "响应等级": level}))
+        # 环比波动率直接写入预分配数组，首小时记 0
+        gl = act_df["grid_load"].to_numpy(dtype=np.float64)
+        fluct = np.zeros_like(gl)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            np.divide(np.diff(gl), gl[:-1], out=fluct[1:])
+        np.abs(fluct, out=fluct)
+        fluct *= 100
+        # 与 pct_change().fillna(0) 一致：0/0 记 0，非零/0 保留 inf
+        np.nan_to_num(fluct, copy=False, nan=0.0, posinf=np.inf)
+        level = LEVEL_LABELS[np.digitize(fluct, LEVEL_BINS)]
+        st.write(pd.DataFrame({"time": act_df["time"], "波动%": np.round(fluct, 1), "响应等级": level}))
 
 # -----------------------------
 # Tab4 成本核算与看板
 # -----------------------------
 if False:
     st.markdown("<div class='section-title'>4. 成本核算与数据看板</div>", unsafe_allow_html=True)
-    act_df = st.session_state.get("act_df", pd.DataFrame())
+    act_df = st.session_state.get("act_df", EMPTY_DF)
     if act_df.empty:
         st.warning("请先完成调度决策步骤")
     else:
@@ -1093,7 +1307,7 @@ if False:
         with col2: st.markdown(f"<div class='metric-card'>预计营收：<b class='green'>{total_rev:.2f} 元</b></div>", unsafe_allow_html=True)
         with col3: st.markdown(f"<div class='metric-card'>毛利：<b class='green'>{total_margin:.2f} 元</b></div>", unsafe_allow_html=True)
         # 毛利曲线
-        fig2 = px.line(act_df, x="time", y="margin", title="毛利时间序列")
+        fig2 = px.line(act_df, x="time", y="margin", title="毛利时间序列", render_mode="webgl")
         st.plotly_chart(fig2, use_container_width=True)
         st.subheader("模型与指标（拟合优度）")
         model_res = st.session_state.get("model_res", None)
@@ -1113,8 +1327,8 @@ if False:
 # -----------------------------
 if False:
     st.markdown("<div class='section-title'>5. 报表导出（调度方案与成本核算）</div>", unsafe_allow_html=True)
-    act_df = st.session_state.get("act_df", pd.DataFrame())
-    preds_df = st.session_state.get("preds_df", pd.DataFrame())
+    act_df = st.session_state.get("act_df", EMPTY_DF)
+    preds_df = st.session_state.get("preds_df", EMPTY_DF)
     colx, coly = st.columns(2)
     with colx:
         if not preds_df.empty:
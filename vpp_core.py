@@ -1,7 +1,12 @@
 import pandas as pd
 import numpy as np
-import random
 from datetime import datetime, timedelta
+try:
+    from numba import njit
+except ImportError:
+    # numba 为可选依赖：未安装时 SOC 递推按纯 Python 循环执行
+    def njit(*args, **kwargs):
+        return lambda f: f
 
 # --- 1. 数据采集与模拟 (Data Simulation) ---
 
@@ -17,36 +22,42 @@ class DataSimulator:
             '仓储物流': {'base_load': 80, 'peak_ratio': 0.3, 'profile': 'flat'},
             '办公服务': {'base_load': 200, 'peak_ratio': 0.7, 'profile': 'day_high'}
         }
+        self.rng = np.random.default_rng()
 
     def generate_new_businesses(self, num=5):
         """模拟采集新增工商户数据"""
-        data = []
-        for _ in range(num):
-            industry = random.choice(self.industries)
-            data.append({
-                'company_name': f"模拟企业_{random.randint(1000, 9999)}",
-                'industry': industry,
-                'registered_capital': random.randint(50, 1000), # 万元
-                'scale': random.choice(['S', 'M', 'L']),
-                'reg_date': datetime.now().strftime('%Y-%m-%d')
-            })
-        return pd.DataFrame(data)
+        # 各字段整列一次抽样（integers 上界开区间，故 +1 以包含上界）
+        ids = self.rng.integers(1000, 10000, size=num)
+        return pd.DataFrame({
+            'company_name': [f"模拟企业_{i}" for i in ids],
+            'industry': self.rng.choice(self.industries, size=num),
+            'registered_capital': self.rng.integers(50, 1001, size=num), # 万元
+            'scale': self.rng.choice(['S', 'M', 'L'], size=num),
+            'reg_date': datetime.now().strftime('%Y-%m-%d')
+        })
 
     def generate_realtime_power_data(self, hour):
         """模拟某一时刻的电力数据"""
+        return self.generate_realtime_power_data_batch(np.array([hour])).iloc[0].to_dict()
+
+    def generate_realtime_power_data_batch(self, hours):
+        """按小时数组批量模拟电力数据，每个小时一行"""
+        hours = np.asarray(hours, dtype=np.int64)
+        n = hours.size
         # 峰谷电价模拟 (简化版：8-22为峰，其余为谷)
-        is_peak = 8 <= hour <= 22
-        grid_price = 1.2 if is_peak else 0.4
+        is_peak = (hours >= 8) & (hours <= 22)
+        is_day = (hours >= 6) & (hours <= 18)
+        today = pd.Timestamp(datetime.now().date())
         
-        return {
-            'timestamp': datetime.now().replace(hour=hour, minute=0, second=0).strftime('%Y-%m-%d %H:%M:%S'),
-            'hour': hour,
+        return pd.DataFrame({
+            'timestamp': (today + pd.to_timedelta(hours, unit='h')).strftime('%Y-%m-%d %H:%M:%S'),
+            'hour': hours,
             'is_peak': is_peak,
-            'grid_price': grid_price, # 电网电价
-            'pv_output': max(0, np.sin((hour - 6) * np.pi / 12) * 1000) if 6 <= hour <= 18 else 0, # 光伏出力模拟
-            'grid_load': random.uniform(2000, 5000) + (1000 if is_peak else 0), # 区域总负荷
-            'storage_level': random.uniform(20, 90) # 当前储能电量 %
-        }
+            'grid_price': np.where(is_peak, 1.2, 0.4), # 电网电价
+            'pv_output': np.where(is_day, np.maximum(0, np.sin((hours - 6) * np.pi / 12) * 1000), 0.0), # 光伏出力模拟
+            'grid_load': self.rng.uniform(2000, 5000, size=n) + np.where(is_peak, 1000, 0), # 区域总负荷
+            'storage_level': self.rng.uniform(20, 90, size=n) # 当前储能电量 %
+        })
 
 # --- 2. 数据处理与预测 (Processing & Prediction) ---
 
@@ -58,23 +69,46 @@ class DataProcessor:
 
     def predict_load(self, business_df):
         """基于行业画像预测负荷"""
-        predictions = []
-        for _, row in business_df.iterrows():
-            profile = self.simulator.industry_profiles.get(row['industry'], {})
-            # 简单逻辑：注册资本 * 行业基准系数 (仅作演示)
-            scale_factor = row['registered_capital'] / 100
-            predicted_load = profile.get('base_load', 100) * scale_factor
-            
-            predictions.append({
-                'company_name': row['company_name'],
-                'industry': row['industry'],
-                'predicted_peak_load': predicted_load,
-                'load_profile_type': profile.get('profile')
-            })
-        return pd.DataFrame(predictions)
+        profiles = self.simulator.industry_profiles
+        base_load_map = pd.Series({k: v['base_load'] for k, v in profiles.items()})
+        profile_map = pd.Series({k: v['profile'] for k, v in profiles.items()})
+        industry = business_df['industry']
+        # 简单逻辑：注册资本 * 行业基准系数 (仅作演示)，未知行业基准取 100
+        scale_factor = business_df['registered_capital'].to_numpy() / 100
+        predicted_load = industry.map(base_load_map).fillna(100).to_numpy() * scale_factor
+        
+        return pd.DataFrame({
+            'company_name': business_df['company_name'].to_numpy(),
+            'industry': industry.to_numpy(),
+            'predicted_peak_load': predicted_load,
+            'load_profile_type': industry.map(profile_map).to_numpy()
+        })
 
 # --- 3. 调度决策 (Scheduling Decision) ---
 
+@njit(cache=True)
+def soc_trajectory(discharge, charge, soc0, capacity, min_soc, max_soc, max_power):
+    """
+    SOC 逐小时递推：discharge 时段放电、charge 时段充电，其余保持，返回 (储能功率, 更新后SOC)
+    充放电功率取决于当前 SOC，两者必须在同一循环内推进
+    """
+    n = discharge.size
+    storage_power = np.zeros(n)
+    soc = np.empty(n)
+    s = soc0
+    for i in range(n):
+        p = 0.0
+        if discharge[i]:
+            if s > min_soc:
+                p = -min(max_power, (s - min_soc) / 100 * capacity)
+        elif charge[i]:
+            if s < max_soc:
+                p = min(max_power, (max_soc - s) / 100 * capacity)
+        s = min(100.0, max(0.0, s + p / capacity * 100))
+        storage_power[i] = p
+        soc[i] = s
+    return storage_power, soc
+
 class Scheduler:
     """调度决策核心模块"""
     
@@ -86,38 +120,39 @@ class Scheduler:
     def make_decision(self, power_status, predicted_load_sum):
         """
         生成调度指令
-        核心逻辑：削峰填谷
+        核心逻辑：削峰填谷（单时刻视为长度为 1 的批量，SOC 取当前储能电量）
         """
-        decision = {
-            'action': 'HOLD',
-            'storage_power': 0, # +充电, -放电
-            'grid_purchase': 0,
-            'reason': ''
+        row = self.make_decision_batch(pd.DataFrame([power_status]), power_status['storage_level']).iloc[0]
+        return {
+            'action': row['action'],
+            'storage_power': row['storage_power'], # +充电, -放电
+            'grid_purchase': row['grid_purchase'],
+            'reason': row['reason']
         }
-        
-        net_load = power_status['grid_load'] - power_status['pv_output']
-        current_soc = power_status['storage_level']
-        
-        if power_status['is_peak']:
-            # 峰段逻辑：优先放电，减少购电
-            if current_soc > self.min_soc:
-                decision['action'] = 'DISCHARGE'
-                decision['storage_power'] = -min(500, (current_soc - self.min_soc) / 100 * self.storage_capacity)
-                decision['reason'] = '峰段高价，储能放电削峰'
-            else:
-                decision['reason'] = '峰段但电量不足，停止放电'
-        else:
-            # 谷段逻辑：低价充电
-            if current_soc < self.max_soc:
-                decision['action'] = 'CHARGE'
-                decision['storage_power'] = min(500, (self.max_soc - current_soc) / 100 * self.storage_capacity)
-                decision['reason'] = '谷段低价，储能充电填谷'
-            else:
-                decision['reason'] = '谷段但电量已满，停止充电'
-                
-        # 计算最终需要从电网购买的电量
-        decision['grid_purchase'] = max(0, net_load + decision['storage_power'])
-        return decision
+
+    def make_decision_batch(self, df, init_soc):
+        """
+        整段时序的批量调度（与 make_decision 同一策略）
+        输入列：grid_load, pv_output, is_peak；SOC 从 init_soc 出发逐小时滚动
+        """
+        is_peak = df['is_peak'].to_numpy(dtype=bool)
+        net_load = df['grid_load'].to_numpy(dtype=np.float64) - df['pv_output'].to_numpy(dtype=np.float64)
+        # SOC 是唯一的时序依赖，交给编译后的 soc_trajectory 推进
+        storage_power, soc = soc_trajectory(is_peak, ~is_peak, float(init_soc), float(self.storage_capacity),
+                                            float(self.min_soc), float(self.max_soc), 500.0)
+
+        # 其余字段按列计算
+        action = np.where(storage_power < 0, 'DISCHARGE', np.where(storage_power > 0, 'CHARGE', 'HOLD'))
+        reason = np.where(is_peak,
+                          np.where(storage_power < 0, '峰段高价，储能放电削峰', '峰段但电量不足，停止放电'),
+                          np.where(storage_power > 0, '谷段低价，储能充电填谷', '谷段但电量已满，停止充电'))
+        return pd.DataFrame({
+            'action': action,
+            'storage_power': storage_power,
+            'grid_purchase': np.maximum(0, net_load + storage_power),
+            'reason': reason,
+            'soc': soc
+        }, index=df.index)
 
 # --- 4. 成本核算 (Cost Analysis) ---
 
@@ -135,6 +170,15 @@ class CostAnalyzer:
             'margin': round(revenue - cost, 2)
         }
 
+    def calculate_margin_batch(self, decisions, power_status):
+        """按列计算边际收益，返回 (cost, revenue, margin) 三个数组"""
+        grid_purchase = decisions['grid_purchase'].to_numpy(dtype=np.float64)
+        price = power_status['grid_price'].to_numpy(dtype=np.float64)
+        cost = grid_purchase * price
+        sales_price = price * 1.1
+        revenue = (grid_purchase - decisions['storage_power'].to_numpy(dtype=np.float64)) * sales_price
+        return np.round(cost, 2), np.round(revenue, 2), np.round(revenue - cost, 2)
+
 # --- Main Execution Flow ---
 
 def run_demo():